@@ -0,0 +1,31 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, initializedcheck=False
+# distutils: extra_compile_args = -O3 -march=native
+"""
+Bellman-Ford min-plus kernel for cvclient, compiled to C.
+build in place with: cythonize -i bf.pyx
+"""
+
+cdef double INF = float("inf")
+
+
+cpdef void bf_kernel(double[::1] direct, double[:, ::1] C,
+                     double[::1] out_cost, Py_ssize_t[::1] out_route,
+                     double max_cost) noexcept:
+    """ out_cost[j], out_route[j] = cheapest direct[i] + C[i, j] over i and its i (-1 if unreachable), INF past max_cost """
+    cdef Py_ssize_t n = C.shape[0], m = C.shape[1]
+    cdef Py_ssize_t i, j
+    cdef double d, v
+    for j in range(m):
+        out_cost[j] = INF
+        out_route[j] = -1
+    # row-major walk over C; strict < keeps the first neighbor on ties, like argmin
+    for i in range(n):
+        d = direct[i]
+        for j in range(m):
+            v = d + C[i, j]
+            if v < out_cost[j]:
+                out_cost[j] = v
+                out_route[j] = i
+    for j in range(m):
+        if out_cost[j] > max_cost:
+            out_cost[j] = INF
@@ -1,14 +1,33 @@
 # -*- coding: utf-8 -*-
-import sys, socket, json, time
-from select import select
+import sys, os, errno, socket, json, struct, time
+import ctypes, ctypes.util
+import selectors
 from collections import defaultdict, namedtuple
 from threading import Thread, Timer
 from datetime import datetime
-import copy
+import numpy as np
+try:
+    # the cython build of the kernel, see bf.pyx
+    from bf import bf_kernel as bf_compiled
+except ImportError:
+    bf_compiled = None
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 import prettytable as pt
 import operator
 
 SIZE = 4096
+# (host, port) -> "host:port", filled by addr2key
+addr_cache = {}
+# "host:port" -> its length-prefixed bytes in a costsupdate, filled by pack_costs
+addr_entry = {}
+# kernel send/receive buffer size requested for the UDP socket
+SOCK_BUF = 4 << 20
+INF = float("inf")
+# any path costing more than this is treated as unreachable
+MAX_COST = 15
 # the value to switch the poisoned_cost
 poisoned_flag = 1
 # user commands and inter-node protocol update types
@@ -20,8 +39,25 @@ LINKCHANGE    = "linkchange"
 SHOWRT        = "showrt"
 CLOSE         = "close"
 COSTSUPDATE   = "costsupdate"
+KEEPALIVE     = "keepalive"
+RESYNC        = "resync"
 SHOWNEIGHBORS = "neighbors"
 NODES         = "nodes"
+# showrt layout, unless run with --pretty
+RT_HEADER = "{0:<12}{1:<12}{2:>8}".format("destination", "nexthop", "cost")
+RT_ROW    = "{0:<12}{1:<12}{2:>8.2f}"
+# costsupdate travels in a binary layout (see pack_costs), the rare user
+# triggered messages stay json. json always starts with '{', never with 1.
+TYPE_COSTSUPDATE = 1
+TYPE_KEEPALIVE   = 2
+TYPE_RESYNC      = 3
+# a keepalive and a resync request are just their type byte
+KEEPALIVE_MSG = bytes([TYPE_KEEPALIVE])
+RESYNC_MSG    = bytes([TYPE_RESYNC])
+# resend full costs at least this often even if nothing changed, in case one got lost
+REFRESH_TICKS = 10
+HDR   = struct.Struct('<BdH')  # type, direct cost, number of entries
+ENTRY = struct.Struct('<d')    # cost, after a length-prefixed addr
 
 
 class RepeatTimer(Thread):
@@ -65,38 +101,364 @@ class ResettableTimer():
         self.countdown.cancel()
 
 
+class iovec(ctypes.Structure):
+    """ struct iovec from <sys/uio.h> """
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len',  ctypes.c_size_t)]
 
-def estimate_costs():
-    """ recalculate inter-node path costs using bellman ford algorithm """
-    for destination_addr, destination in nodes.items():
-        # we don't need to update the distance to ourselves
-        if destination_addr != me:
-            # iterate through neighbors and find cheapest route
-            cost = float("inf")
-            nexthop = ''
-            for neighbor_addr, neighbor in get_neighbors().items():
-                # distance = direct cost to neighbor + cost from neighbor to destination
-                if destination_addr in neighbor['costs']:
-                    dist = neighbor['direct'] + neighbor['costs'][destination_addr]
-                    if dist < cost:
-                        cost = dist
-                        if cost > 15:
-                            cost = float("inf")
-                        nexthop = neighbor_addr
-            # set new estimated cost to node in the network
-            destination['cost'] = cost
-            destination['route'] = nexthop
+
+class sockaddr_in(ctypes.Structure):
+    """ struct sockaddr_in from <netinet/in.h> """
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port',   ctypes.c_uint16),
+                ('sin_addr',   ctypes.c_ubyte * 4),
+                ('sin_zero',   ctypes.c_ubyte * 8)]
+
+
+class msghdr(ctypes.Structure):
+    """ struct msghdr from <sys/socket.h> """
+    _fields_ = [('msg_name',       ctypes.c_void_p),
+                ('msg_namelen',    ctypes.c_uint32),
+                ('msg_iov',        ctypes.POINTER(iovec)),
+                ('msg_iovlen',     ctypes.c_size_t),
+                ('msg_control',    ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags',      ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    """ struct mmsghdr from <sys/socket.h> """
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def load_libc():
+    """ return libc if it exposes sendmmsg/recvmmsg (linux only), otherwise None """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    if not (hasattr(libc, 'sendmmsg') and hasattr(libc, 'recvmmsg')):
+        return None
+    libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    libc.sendmmsg.restype = ctypes.c_int
+    libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    libc.recvmmsg.restype = ctypes.c_int
+    return libc
+
+libc = load_libc()
+
+
+def sendmmsg(sock, msgs):
+    """ send a list of (data, (host, port)) datagrams, batched into one syscall when possible """
+    # a datagram that fails is skipped, not retried, so it can't hold back the
+    # ones behind it. the failures are raised together once the rest are out
+    failed = []
+    if libc is None:
+        # no sendmmsg on this platform, fall back to one sendto per datagram
+        for data, addr in msgs:
+            try:
+                sock.sendto(data, addr)
+            except OSError as e:
+                failed.append((addr, e.errno))
+        raise_send_errors(failed)
+        return
+    n = len(msgs)
+    hdrs  = (mmsghdr * n)()
+    iovs  = (iovec * n)()
+    names = (sockaddr_in * n)()
+    for k, (data, (host, port)) in enumerate(msgs):
+        iovs[k].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+        iovs[k].iov_len  = len(data)
+        names[k].sin_family = socket.AF_INET
+        names[k].sin_port   = socket.htons(port)
+        names[k].sin_addr   = (ctypes.c_ubyte * 4)(*socket.inet_aton(host))
+        hdrs[k].msg_hdr.msg_name    = ctypes.cast(ctypes.byref(names[k]), ctypes.c_void_p)
+        hdrs[k].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+        hdrs[k].msg_hdr.msg_iov     = ctypes.pointer(iovs[k])
+        hdrs[k].msg_hdr.msg_iovlen  = 1
+    sent = 0
+    while sent < n:
+        # the kernel may stop early, so resubmit whatever is left
+        ret = libc.sendmmsg(sock.fileno(), ctypes.byref(hdrs[sent]), n - sent, 0)
+        if ret < 0:
+            # the kernel stopped at msgs[sent], drop just that one and carry on
+            failed.append((msgs[sent][1], ctypes.get_errno()))
+            sent += 1
+            continue
+        sent += ret
+    raise_send_errors(failed)
+
+
+def raise_send_errors(failed):
+    """ raise one OSError for a list of (addr, errno) send failures, if any """
+    if not failed:
+        return
+    err = failed[0][1]
+    raise OSError(err, ", ".join("{0}:{1} {2}".format(host, port, os.strerror(e)) for (host, port), e in failed))
+
+
+class BatchReceiver():
+
+    """
+    drain every queued datagram from a non-blocking socket, vlen per recvmmsg call, reusing the same buffers
+    """
+    def __init__(self, sock, vlen=64):
+        self.sock = sock
+        self.vlen = vlen
+        if libc is None:
+            return
+        self.bufs  = (ctypes.c_char * SIZE * vlen)()
+        self.iovs  = (iovec * vlen)()
+        self.names = (sockaddr_in * vlen)()
+        self.hdrs  = (mmsghdr * vlen)()
+        for k in range(vlen):
+            self.iovs[k].iov_base = ctypes.cast(ctypes.byref(self.bufs[k]), ctypes.c_void_p)
+            self.iovs[k].iov_len  = SIZE
+            self.hdrs[k].msg_hdr.msg_name   = ctypes.cast(ctypes.byref(self.names[k]), ctypes.c_void_p)
+            self.hdrs[k].msg_hdr.msg_iov    = ctypes.pointer(self.iovs[k])
+            self.hdrs[k].msg_hdr.msg_iovlen = 1
+    def recv(self):
+        """ return a list of (data, (host, port)) for every datagram currently queued """
+        batch = []
+        if libc is None:
+            # no recvmmsg on this platform, recvfrom until the socket runs dry
+            while True:
+                try:
+                    batch.append(self.sock.recvfrom(SIZE))
+                except BlockingIOError:
+                    return batch
+        while True:
+            for k in range(self.vlen):
+                # the kernel overwrites the address length, so reset it every call
+                self.hdrs[k].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            ret = libc.recvmmsg(self.sock.fileno(), self.hdrs, self.vlen, socket.MSG_DONTWAIT, None)
+            if ret < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return batch
+                raise OSError(err, os.strerror(err))
+            batch += [(ctypes.string_at(self.bufs[k], self.hdrs[k].msg_len),
+                       (socket.inet_ntoa(bytes(self.names[k].sin_addr)), socket.ntohs(self.names[k].sin_port)))
+                      for k in range(ret)]
+            # a short batch means the queue is empty
+            if ret < self.vlen:
+                return batch
+
+
+def pack_costs(costs, direct):
+    """
+    encode a costsupdate: header, then (addr length, addr, cost) per destination.
+    returns the buffer and the offset of each destination's cost, for patching in place
+    """
+    buf = bytearray(HDR.pack(TYPE_COSTSUPDATE, direct, len(costs)))
+    offsets = {}
+    # bound once, the loop runs per destination every tick
+    pack = ENTRY.pack
+    for addr, cost in costs.items():
+        entry = addr_entry.get(addr)
+        if entry is None:
+            encoded = addr.encode()
+            entry = addr_entry[addr] = bytes([len(encoded)]) + encoded
+        buf += entry
+        offsets[addr] = len(buf)
+        buf += pack(cost)
+    return buf, offsets
+
+
+def unpack_message(data):
+    """ decode a datagram into the { 'type', 'payload' } dict the update handlers expect """
+    if data[0] == TYPE_KEEPALIVE:
+        return { 'type': KEEPALIVE, 'payload': {} }
+    if data[0] == TYPE_RESYNC:
+        return { 'type': RESYNC, 'payload': {} }
+    if data[0] != TYPE_COSTSUPDATE:
+        return json.loads(data)
+    _, direct, count = HDR.unpack_from(data)
+    view = memoryview(data)
+    offset = HDR.size
+    costs = {}
+    for _ in range(count):
+        n = view[offset]
+        # interned so dict lookups on it can short-circuit on identity
+        addr = sys.intern(bytes(view[offset + 1:offset + 1 + n]).decode())
+        offset += 1 + n
+        costs[addr], = ENTRY.unpack_from(view, offset)
+        offset += ENTRY.size
+    return { 'type': COSTSUPDATE, 'payload': { 'costs': costs, 'neighbor': { 'direct': direct } } }
+
+
+
+class Node():
+
+    """
+    dict-style view of one node's slot in the SoA tables, so the control
+    paths can keep using node['cost'] etc. fields that have no array
+    (costs, saved, sockaddr, silence_monitor) are kept on the view itself
+    """
+    fields = ('cost', 'is_neighbor', 'route', 'direct')
+    def __init__(self, addr):
+        self.addr = addr
+        self.k = node_index(addr)
+        self.extra = {}
+    def __getitem__(self, key):
+        if key == 'cost':
+            return float(cost_vec[self.k])
+        if key == 'is_neighbor':
+            return bool(neighbor_vec[self.k])
+        if key == 'route':
+            route = int(route_vec[self.k])
+            return idx2addr[route] if route >= 0 else ''
+        if key == 'direct':
+            return float(direct_vec[self.k])
+        return self.extra[key]
+    def __setitem__(self, key, value):
+        if key == 'cost':
+            cost_vec[self.k] = value
+            current_costs[self.addr] = value
+        elif key == 'is_neighbor':
+            neighbor_vec[self.k] = value
+        elif key == 'route':
+            # index first, node_index may reallocate route_vec
+            route = node_index(value) if value else -1
+            route_vec[self.k] = route
+        elif key == 'direct':
+            direct_vec[self.k] = value
+        elif key == 'costs':
+            self.extra[key] = value
+            set_costs_row(self.addr, value)
+        else:
+            self.extra[key] = value
+    def __delitem__(self, key):
+        del self.extra[key]
+    def __contains__(self, key):
+        return key in self.fields or key in self.extra
+    def items(self):
+        return [(key, self[key]) for key in self.fields] + list(self.extra.items())
+
+
+class NodeTable(dict):
+
+    """
+    addr -> Node, creating a default node on first access like the old defaultdict
+    """
+    def __missing__(self, addr):
+        node = self[addr] = default_node(addr)
+        return node
+
+
+def node_index(addr):
+    """ return addr's slot in the SoA tables, growing every table for new nodes """
+    global cost_vec, route_vec, direct_vec, neighbor_vec, C
+    k = addr2idx.get(addr)
+    if k is None:
+        k = addr2idx[addr] = len(idx2addr)
+        idx2addr.append(addr)
+        cost_vec     = np.append(cost_vec, INF)
+        route_vec    = np.append(route_vec, -1)
+        direct_vec   = np.append(direct_vec, INF)
+        neighbor_vec = np.append(neighbor_vec, False)
+        grown = np.full((k + 1, k + 1), INF)
+        grown[:k, :k] = C
+        C = grown
+    return k
+
+
+def set_costs_row(addr, costs):
+    """ store a neighbor's advertised costs into its row of the cost matrix """
+    cols = [node_index(dest_addr) for dest_addr in costs]
+    k = node_index(addr)
+    C[k] = INF
+    C[k, cols] = list(costs.values())
+
+
+def bf_loops(direct, C, out_cost, out_route, max_cost):
+    """ min-plus relaxation as plain loops, for numba to compile """
+    n, m = C.shape
+    for j in range(m):
+        out_cost[j] = INF
+        out_route[j] = -1
+    # row-major walk over C; strict < keeps the first neighbor on ties, like argmin
+    for i in range(n):
+        d = direct[i]
+        for j in range(m):
+            v = d + C[i, j]
+            if v < out_cost[j]:
+                out_cost[j] = v
+                out_route[j] = i
+    for j in range(m):
+        if out_cost[j] > max_cost:
+            out_cost[j] = INF
+
+
+def bf_vectorized(direct, C, out_cost, out_route, max_cost):
+    """ min-plus relaxation with numpy, used when numba isn't installed """
+    # totals[i, j] = direct cost to neighbor i + cost from neighbor i to destination j
+    totals = direct[:, None] + C
+    nexthops = totals.argmin(axis=0)
+    best = totals[nexthops, np.arange(C.shape[1])]
+    out_cost[:]  = np.where(best > max_cost, INF, best)
+    out_route[:] = np.where(best < INF, nexthops, -1)
+
+
+# out_cost[j], out_route[j] = cheapest direct[i] + C[i, j] over i and its i (-1 if unreachable),
+# costs above max_cost (always MAX_COST, passed in so it lives in one place) become INF
+# prefer the cython extension if it was built, then numba, then plain numpy.
+# (no fastmath: INF is a real value here, not something llvm may assume away)
+# numba compiles eagerly for contiguous arrays: a lazy compile inside the event
+# loop can stall it past the neighbors' silence monitors and take links down
+BF_SIGNATURE = 'void(float64[::1], float64[:, ::1], float64[::1], intp[::1], float64)'
+if bf_compiled is not None:
+    bf_kernel = bf_compiled
+elif njit is not None:
+    bf_kernel = njit(BF_SIGNATURE, cache=True)(bf_loops)
+else:
+    bf_kernel = bf_vectorized
+
+
+def estimate_costs(dests=None):
+    """
+    recalculate inter-node path costs using bellman ford algorithm.
+    only the columns of dests are relaxed if given; returns True if any cost or route changed
+    """
+    global dirty
+    index = addr2idx
+    if dests is None:
+        cols = np.arange(len(index))
+    else:
+        cols = np.array([index[dest_addr] for dest_addr in dests if dest_addr in index], dtype=np.intp)
+    # we don't need to update the distance to ourselves
+    cols = cols[cols != index[me]]
+    # rows of non-neighbors get an infinite direct cost, so they never win
+    direct = np.where(neighbor_vec, direct_vec, INF)
+    cost  = np.empty(len(cols))
+    route = np.empty(len(cols), dtype=np.intp)
+    # (take keeps the columns C-contiguous, plain fancy indexing would not)
+    bf_kernel(direct, C.take(cols, axis=1), cost, route, MAX_COST)
+    moved = (cost_vec[cols] != cost) | (route_vec[cols] != route)
+    if not moved.any():
+        return False
+    # set new estimated cost to node in the network
+    cost_vec[cols] = cost
+    route_vec[cols] = route
+    for k, c in zip(cols[moved].tolist(), cost[moved].tolist()):
+        current_costs[idx2addr[k]] = c
+    dirty = True
+    return True
 
 
 def update_costs(host, port, **kwargs):
     """ update neighbor's costs """
+    global dirty
     costs = kwargs['costs']
     addr = addr2key(host, port) # 这个addr是sender的addr，不是表中所有的addr
     # if a node listed in costs is not in our list of nodes...
     for node in costs:
         if node not in nodes:
             # ... create a new node
-            nodes[node] = default_node()
+            nodes[node] = default_node(node)
     # if node not a neighbor ...
     if not nodes[addr]['is_neighbor']: # 这里是对sender进行判断，也就是接受者的neighbor
         # ... make it your neighbor!
@@ -108,35 +470,116 @@ def update_costs(host, port, **kwargs):
                 direct      = kwargs['neighbor']['direct'],
                 costs       = costs,
                 addr        = addr)
+        # the new neighbor needs our costs even if no route moves
+        dirty = True
+        # run bellman ford
+        estimate_costs()
     else:
         # otherwise just update node costs，更新这个邻接点的costs表单
         node = nodes[addr]
-        node['costs'] = costs
         # restart silence monitor
         node['silence_monitor'].reset()
-    # run bellman ford
-    estimate_costs()
+        # only destinations this neighbor now advertises differently can move
+        old_costs = node['costs']
+        changed = [dest_addr for dest_addr, cost in costs.items() if old_costs.get(dest_addr) != cost]
+        changed += [dest_addr for dest_addr in old_costs if dest_addr not in costs]
+        if not changed:
+            return
+        # a changed vector can mean the neighbor just came up or restarted and
+        # lost ours, answer next tick instead of waiting out REFRESH_TICKS
+        dirty = True
+        # (this also refills the neighbor's row of C)
+        node['costs'] = costs
+        # run bellman ford on the affected destinations
+        estimate_costs(changed)
+
+
+def keepalive(host, port, **kwargs):
+    """ neighbor's costs are unchanged, restart its silence monitor (or ask a dropped neighbor to resync) """
+    node = nodes.get(addr2key(host, port))
+    if node is not None and node['is_neighbor']:
+        node['silence_monitor'].reset()
+        return
+    # the sender still counts us as a neighbor but we timed it out (or never
+    # knew it). keepalives can't re-form the link, ask for a full costsupdate
+    try:
+        sock.sendto(RESYNC_MSG, (host, port))
+    except OSError:
+        # the next keepalive will ask again
+        pass
+
+
+def resync(host, port, **kwargs):
+    """ a neighbor lost our costs, send the full vector next tick """
+    global dirty
+    dirty = True
+    # it's alive too, don't let its silence monitor fire before that send
+    node = nodes.get(addr2key(host, port))
+    if node is not None and node['is_neighbor']:
+        node['silence_monitor'].reset()
 
 
 def broadcast_costs(poisoned_flag):
     """ send estimated path costs to each neighbor """
-    costs = { addr: node['cost'] for addr, node in nodes.items() }
-    data = { 'type': COSTSUPDATE }  # 这个会触发updata_costs的函数
-    for neighbor_addr, neighbor in get_neighbors().items():
-        # poison reverse
-        poisoned_costs = copy.deepcopy(costs)
+    global dirty, quiet_ticks
+    if not dirty and quiet_ticks < REFRESH_TICKS:
+        # nothing moved since the last broadcast, so neighbors already have
+        # these costs. a keepalive is enough to feed their silence monitors
+        quiet_ticks += 1
+        msgs = [(KEEPALIVE_MSG, neighbor['sockaddr']) for neighbor in list(get_neighbors().values())]
+        if msgs:
+            try:
+                sendmmsg(sock, msgs)
+            except OSError as e:
+                # this runs on the RepeatTimer thread, an exception would end it for good
+                print("failed to send keepalives: {0}\n".format(e))
+        return
+    dirty = False
+    quiet_ticks = 0
+    # (one snapshot per tick, the main thread keeps updating current_costs)
+    costs = current_costs.copy()
+    # group destinations by the (index of the) neighbor we route through to reach them
+    routes_via = defaultdict(list)
+    for dest_addr, route in zip(idx2addr, route_vec.tolist()):
+        routes_via[route].append(dest_addr)
+    # COSTSUPDATE 这个会触发updata_costs的函数. every neighbor gets the same
+    # table except for the direct cost in the header and the poisoned entries,
+    # so pack it once into a scratch buffer and patch those per neighbor
+    scratch, offsets = pack_costs(costs, 0.0)
+    # bind globals to locals, the loop below runs per neighbor every tick
+    inf = INF
+    myself = me
+    pack_into = ENTRY.pack_into
+    msgs = []
+    append = msgs.append
+    # (snapshot, linkdown/linkup on the main thread resize neighbors mid-loop)
+    neighbor_items = list(get_neighbors().items())
+    # read direct costs only after the snapshot: a neighbor added in between
+    # would have an index past the end of an older list
+    direct = direct_vec.tolist()
+    for neighbor_addr, neighbor in neighbor_items:
+        poisoned = []
         if poisoned_flag :
-            for dest_addr, cost in costs.items():
+            for dest_addr in routes_via[neighbor.k]:
                 # only do poisoned reverse if destination not me or neighbor
-                if dest_addr not in [me, neighbor_addr]:
-                    # if we route through neighbor to get to destination ...
-                    if nodes[dest_addr]['route'] == neighbor_addr:
-                        # ... tell neighbor distance to destination is infinty!
-                        poisoned_costs[dest_addr] = float("inf")
-        data['payload'] = { 'costs': poisoned_costs }
-        data['payload']['neighbor'] = { 'direct': neighbor['direct'] }
-        # send (potentially 'poisoned') costs to neighbor
-        sock.sendto(json.dumps(data).encode(), key2addr(neighbor_addr))
+                if dest_addr != myself and dest_addr != neighbor_addr and dest_addr in offsets:
+                    # we route through neighbor to get to destination,
+                    # so tell neighbor distance to destination is infinty!
+                    pack_into(scratch, offsets[dest_addr], inf)
+                    poisoned.append(dest_addr)
+        HDR.pack_into(scratch, 0, TYPE_COSTSUPDATE, direct[neighbor.k], len(offsets))
+        append((bytes(scratch), neighbor['sockaddr']))
+        # undo the poison for the next neighbor
+        for dest_addr in poisoned:
+            pack_into(scratch, offsets[dest_addr], costs[dest_addr])
+    # send (potentially 'poisoned') costs to every neighbor at once
+    if msgs:
+        try:
+            sendmmsg(sock, msgs)
+        except OSError as e:
+            # drop this tick's batch but keep the timer thread alive, resend next tick
+            print("failed to send costs: {0}\n".format(e))
+            dirty = True
 
 def setup_server(host, port):
     """ setup a UDP server"""
@@ -147,29 +590,45 @@ def setup_server(host, port):
     except socket.error:
         print("an error occured binding the server socket.error ")
         sys.exit(1)
+    # room for a whole round of updates from every neighbor to queue up
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF)
+    # reads drain the queue until EAGAIN instead of going back to select per packet
+    sock.setblocking(False)
     return sock
 
-def default_node():
-    """default node type"""
-    return { 'cost': float("inf"), 'is_neighbor': False, 'route': '' }
+def default_node(addr):
+    """default node type, (re)initializing addr's slot in the SoA tables"""
+    node = Node(addr)
+    node['cost'] = INF
+    node['is_neighbor'] = False
+    node['route'] = ''
+    node['direct'] = INF
+    C[node.k] = INF
+    return node
 
 
 def create_node(cost, is_neighbor, direct=None, costs=None, addr=None):
     """ centralizes the pattern for creating new nodes """
-    node = default_node()
+    node = default_node(addr)
     node['cost'] = cost
     node['is_neighbor'] = is_neighbor
-    node['direct'] = direct if direct != None else float("inf")
-    node['costs']  = costs  if costs  != None else defaultdict(lambda: float("inf"))
+    node['direct'] = direct if direct != None else INF
+    node['costs']  = costs  if costs  != None else {}
     if is_neighbor:
         node['route'] = addr
+        # cache the resolved (ip, port) so the hot paths don't re-split addr,
+        # sendmmsg only takes dotted ipv4 addresses
+        host, port = key2addr(addr)
+        node['sockaddr'] = (socket.gethostbyname(host), port)
         # ensure neighbor is transmitting cost updates using a resettable timer
         monitor = ResettableTimer(
             interval = 3*run_args.timeout,
             func = linkdown,
-            args = list(key2addr(addr)))
+            args = [host, port])
         monitor.start()
         node['silence_monitor'] = monitor
+        neighbors[addr] = node
     return node
 
 
@@ -185,6 +644,7 @@ def get_node(host, port):
 
 def linkchange(host, port, **kwargs):
     """ change the link between the nodes """
+    global dirty
     node, addr, err = get_node(host, port)
     if err: return
     if not node['is_neighbor']:
@@ -198,6 +658,8 @@ def linkchange(host, port, **kwargs):
         print("this link currently down. please first bring link back to life using LINKUP cmd.")
         return
     node['direct'] = direct
+    # neighbor is told the new direct cost with our costs
+    dirty = True
     # run bellman-ford
     estimate_costs()
 
@@ -211,15 +673,17 @@ def linkdown(host, port, **kwargs):
         return
     # save direct distance to neighbor, then set to infinity
     node['saved'] = node['direct']
-    node['direct'] = float("inf")
+    node['direct'] = INF
     node['is_neighbor'] = False
     node['silence_monitor'].cancel()
+    neighbors.pop(addr, None)
     # run bellman-ford
     estimate_costs()
 
 
 def linkup(host, port, **kwargs):
     """ recover the link bwtween the nodes """
+    global dirty
     node, addr, err = get_node(host, port)
     if err: return
     # make sure node was previously taken down via LINKDOWN cmd
@@ -230,6 +694,8 @@ def linkup(host, port, **kwargs):
     node['direct'] = node['saved']
     del node['saved']
     node['is_neighbor'] = True
+    neighbors[addr] = node
+    dirty = True
     # run bellman-ford
     estimate_costs()
 
@@ -251,14 +717,6 @@ def show_neighbors():
     # print # extra line
 
 
-def get_neighbors_num():
-    """get active neighbors num"""
-    neighbors_num = 0
-    for _, _ in get_neighbors().items():
-        neighbors_num += 1
-    return neighbors_num
-
-
 def showrt():
     """ display routing info: cost to destination; route to take """
     print(formatted_now())
@@ -272,12 +730,21 @@ def showrt():
     #                     cost        = node['cost'],
     #                     nexthop     = node['route'])
     # print # extra line
-    tb = pt.PrettyTable()
-    tb.field_names = ["destination", "nexthop", "cost"]
-    for addr, node in nodes.items():
+    if run_args.pretty:
+        tb = pt.PrettyTable()
+        tb.field_names = ["destination", "nexthop", "cost"]
+        for addr, node in nodes.items():
+            if addr != me:
+                tb.add_row([node_name[addr[-5:]], node_name[node['route'][-5:]], node['cost']])
+        print(tb)
+        return
+    # fixed-width rows straight from the SoA tables, much cheaper than PrettyTable
+    rows = [RT_HEADER]
+    for addr, cost, route in zip(idx2addr, cost_vec.tolist(), route_vec.tolist()):
         if addr != me:
-            tb.add_row([node_name[addr[-5:]], node_name[node['route'][-5:]], node['cost']])
-    print(tb)
+            nexthop = idx2addr[route] if route >= 0 else ''
+            rows.append(RT_ROW.format(node_name[addr[-5:]], node_name[nexthop[-5:]], cost))
+    print("\n".join(rows))
 
 
 def close():
@@ -299,8 +766,11 @@ def key2addr(key):
 
 
 def addr2key(host, port):
-    """addr to key"""
-    return "{host}:{port}".format(host=host, port=port)
+    """addr to key, interned and cached since the same few addrs come up constantly"""
+    key = addr_cache.get((host, port))
+    if key is None:
+        key = addr_cache[(host, port)] = sys.intern("{host}:{port}".format(host=host, port=port))
+    return key
 
 
 def get_host(host):
@@ -310,7 +780,7 @@ def get_host(host):
 
 def get_neighbors():
     """ return dict of all neighbors (does not include self) """
-    return dict([d for d in nodes.items() if d[1]['is_neighbor']])
+    return neighbors
 
 
 def is_number(n):
@@ -336,6 +806,9 @@ def parse_argv():
     """
     s = sys.argv[1:]
     parsed = {}
+    # --pretty may appear anywhere: draw showrt with PrettyTable
+    parsed['pretty'] = '--pretty' in s
+    s = [arg for arg in s if arg != '--pretty']
     # validate port
     port = s.pop(0)
     if not is_int(port):
@@ -425,6 +898,8 @@ updates = {
     LINKUP     : linkup,
     LINKCHANGE : linkchange,
     COSTSUPDATE: update_costs,
+    KEEPALIVE  : keepalive,
+    RESYNC     : resync,
 }
 node_name = {
     '20000' : "A",
@@ -441,10 +916,28 @@ if __name__ == '__main__':
     if 'error' in parsed:
         print(parsed['error'])
         sys.exit(1)
-    RunArgs = namedtuple('RunInfo', 'port timeout neighbors costs')
+    RunArgs = namedtuple('RunInfo', 'port timeout neighbors costs pretty')
     run_args = RunArgs(**parsed)
     # initialize dict of nodes to all neighbors
-    nodes = defaultdict(lambda: default_node())
+    nodes = NodeTable()
+    # active neighbors, kept in step with nodes[addr]['is_neighbor']
+    neighbors = {}
+    # SoA storage behind nodes: per-node parallel arrays indexed by addr2idx,
+    # plus C[i, j] = cost to node j advertised by neighbor i.
+    # route_vec holds the index of the nexthop, -1 for none
+    addr2idx = {}
+    idx2addr = []
+    cost_vec     = np.empty(0)
+    route_vec    = np.empty(0, dtype=np.intp)
+    direct_vec   = np.empty(0)
+    neighbor_vec = np.empty(0, dtype=bool)
+    C = np.empty((0, 0))
+    # addr -> cost_vec entry as a dict, kept current so broadcast_costs needn't rebuild it
+    current_costs = {}
+    # set whenever our costs, routes or links change; while it stays clear
+    # broadcast_costs sends keepalives instead of resending the same costs
+    dirty = True
+    quiet_ticks = 0
     for neighbor, cost in zip(run_args.neighbors, run_args.costs):
         nodes[neighbor] = create_node(
                 cost=cost, direct=cost, is_neighbor=True, addr=neighbor)
@@ -454,26 +947,40 @@ if __name__ == '__main__':
     me = addr2key(*sock.getsockname())
     nodes[me] = create_node(cost=0.0, direct=0.0, is_neighbor=False, addr=me)
     # for print the log
-    neighbors_num = get_neighbors_num()
+    neighbors_num = len(neighbors)
     i = 0
     # for converge
     show_flag = 1
     iter_num = 0
-    nodes_costs = {addr: node['cost'] for addr, node in nodes.items()}
-    pre_nodes_costs = copy.deepcopy(nodes_costs)
+    nodes_costs = cost_vec.tolist()
+    pre_nodes_costs = nodes_costs.copy()
     # broadcast costs every timeout seconds
     broadcast_costs(poisoned_flag)
-    RepeatTimer(run_args.timeout, broadcast_costs).start()
+    RepeatTimer(run_args.timeout, lambda: broadcast_costs(poisoned_flag)).start()
 
     # listen for updates from other nodes and user input
-    inputs = [sock, sys.stdin]
+    # (registered once, DefaultSelector is epoll on linux)
+    sel = selectors.DefaultSelector()
+    try:
+        sel.register(sys.stdin, selectors.EVENT_READ)
+    except PermissionError:
+        # epoll refuses regular files and /dev/null, select() takes them (always readable)
+        sel.close()
+        sel = selectors.SelectSelector()
+        sel.register(sys.stdin, selectors.EVENT_READ)
+    sel.register(sock, selectors.EVENT_READ)
+    receiver = BatchReceiver(sock)
     running = True
     while running:
-        in_ready, out_ready, except_ready = select(inputs,[],[])
-        for s in in_ready:
-            if s == sys.stdin:
+        for key, _ in sel.select():
+            if key.fileobj == sys.stdin:
                 # user input command
-                parsed = parse_user_input(sys.stdin.readline())
+                line = sys.stdin.readline()
+                if not line:
+                    # stdin closed (or a file/devnull ran out), keep routing without it
+                    sel.unregister(sys.stdin)
+                    continue
+                parsed = parse_user_input(line)
                 if 'error' in parsed:
                     print(parsed['error'])
                     continue
@@ -485,37 +992,37 @@ if __name__ == '__main__':
                 # perform cmd on this side of the link
                 user_cmds[cmd](*parsed['addr'], **parsed['payload'])
             else:
-                # update from another node
-                i += 1
-                data, sender = s.recvfrom(SIZE)
-                loaded = json.loads(data)
-                update = loaded['type']
-                payload = loaded['payload']
-                if update not in updates:
-                    print("'{0}' is not in the update protocol\n".format(update))
-                    continue
-                updates[update](*sender, **payload)
-                nodes_costs = {addr: node['cost'] for addr, node in nodes.items()}
-                # for test
-                #print("receive message ", i)
-                # show the result when collect all the message from the neighbors
-                if i % neighbors_num == 0 and show_flag == 1 :
-                    if operator.eq(pre_nodes_costs,nodes_costs) == 1:
-                        show_flag = 0
-                        print("The network has converged:")
-                    else:
-                        pass
-                    showrt()
-                    i = 0
-                    pre_nodes_costs = copy.deepcopy(nodes_costs)
-                elif i % neighbors_num == 0 and show_flag == 0:
-                    if operator.eq(pre_nodes_costs, nodes_costs) == 1:
-                        pass
-                    else:
+                # updates from other nodes, drained until the socket is empty
+                for data, sender in receiver.recv():
+                    i += 1
+                    loaded = unpack_message(data)
+                    update = loaded['type']
+                    payload = loaded['payload']
+                    if update not in updates:
+                        print("'{0}' is not in the update protocol\n".format(update))
+                        continue
+                    updates[update](*sender, **payload)
+                    nodes_costs = cost_vec.tolist()
+                    # for test
+                    #print("receive message ", i)
+                    # show the result when collect all the message from the neighbors
+                    if i % neighbors_num == 0 and show_flag == 1 :
+                        if operator.eq(pre_nodes_costs,nodes_costs) == 1:
+                            show_flag = 0
+                            print("The network has converged:")
+                        else:
+                            pass
                         showrt()
-                        show_flag = 1
-                    i = 0
-                    pre_nodes_costs = copy.deepcopy(nodes_costs)
+                        i = 0
+                        pre_nodes_costs = nodes_costs.copy()
+                    elif i % neighbors_num == 0 and show_flag == 0:
+                        if operator.eq(pre_nodes_costs, nodes_costs) == 1:
+                            pass
+                        else:
+                            showrt()
+                            show_flag = 1
+                        i = 0
+                        pre_nodes_costs = nodes_costs.copy()
 
 
 